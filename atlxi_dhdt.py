@@ -30,11 +30,12 @@
 #   - Uses the `deepicedrain.nanptp` function
 # 3. Calculate rate of height change over time (dhdt)
 #   - Done for points with `h_range > 0.25 metres`
-#   - Uses the `deepicedrain.nan_linregress` function
+#   - Uses the `deepicedrain.nan_linregress_block` function
 #
 # Adapted from https://github.com/suzanne64/ATL11/blob/master/plotting_scripts/AA_dhdt_map.ipynb
 
 # %%
+import glob
 import os
 
 import cudf  # comment out if no GPU
@@ -44,17 +45,26 @@ import holoviews as hv
 import hvplot.cudf  # comment out if no GPU
 import hvplot.pandas
 import intake
+import numcodecs
 import numpy as np
 import pandas as pd
 import panel as pn
 import pygmt
 import tqdm
 import xarray as xr
+import zarr
 
 import deepicedrain
 
 # %%
-client = dask.distributed.Client(n_workers=32, threads_per_worker=1)
+# Fuse linear chains of tasks (e.g. read -> mask -> reduce) into single tasks
+dask.config.set({"optimization.fuse.active": True})
+# Use half as many workers as there are logical CPUs (at least one), with 2
+# threads each, so that there are fewer workers for the scheduler to coordinate,
+# and each worker gets a bigger share of the memory for the tall and skinny chunks
+client = dask.distributed.Client(
+    n_workers=max(1, os.cpu_count() // 2), threads_per_worker=2, memory_limit="auto"
+)
 client
 
 # %% [markdown]
@@ -69,14 +79,34 @@ add_path_to_ds = lambda ds: ds.assign_coords(
     )
 )
 
+# %%
+# Use a tall and skinny chunk layout, with all cycles contiguous in one chunk
+# and as many ref_pts per chunk as will fit into ~128MB of height values.
+# Round down to a multiple of the on-disk Zarr chunk length along ref_pt
+# (taken from the first store, assuming all stores use the same chunking),
+# so that when each store is opened, its dask chunks start on Zarr chunk edges
+h_corr_zarr: zarr.Array = zarr.open_consolidated(
+    store=sorted(glob.glob("ATL11.001z123/ATL11_*_003_01.zarr"))[0]
+)["h_corr"]
+dims: list = h_corr_zarr.attrs["_ARRAY_DIMENSIONS"]
+zarr_chunksize: int = h_corr_zarr.chunks[dims.index("ref_pt")]
+ref_pt_chunksize: int = (128 * 1024 ** 2) // (
+    h_corr_zarr.shape[dims.index("cycle_number")] * h_corr_zarr.dtype.itemsize
+)
+ref_pt_chunksize: int = max(
+    zarr_chunksize, ref_pt_chunksize // zarr_chunksize * zarr_chunksize
+)
+print(f"Using chunks of {ref_pt_chunksize} ref_pts (Zarr chunks: {zarr_chunksize})")
+
+# %%
 # Load ATL11 data from Zarr
 ds: xr.Dataset = xr.open_mfdataset(
     paths="ATL11.001z123/ATL11_*_003_01.zarr",
-    chunks="auto",
+    chunks={"cycle_number": -1, "ref_pt": ref_pt_chunksize},
     engine="zarr",
     combine="nested",
     concat_dim="ref_pt",
-    parallel="True",
+    parallel=True,
     preprocess=add_path_to_ds,
     backend_kwargs={"consolidated": True},
 )
@@ -88,18 +118,42 @@ ds: xr.Dataset = xr.open_mfdataset(
 # - Mask out low quality height data
 
 # %%
-# Calculate the EPSG:3031 x/y projection coordinates
-ds["x"], ds["y"] = deepicedrain.lonlat_to_xy(
-    longitude=ds.longitude, latitude=ds.latitude
+# Calculate the EPSG:3031 x/y projection coordinates, or load them if they
+# have been calculated before, since they only depend on longitude/latitude.
+# Delete the cached Zarr store if the list of ATL11 files being loaded changes!
+xy_store: str = "ATLXI/xy_epsg3031.zarr"
+if not os.path.exists(xy_store):
+    x, y = deepicedrain.lonlat_to_xy(longitude=ds.longitude, latitude=ds.latitude)
+    ds_xy: xr.Dataset = xr.Dataset(data_vars={"x": x.variable, "y": y.variable})
+    # Zarr needs evenly sized chunks, so merge the per-store chunks first
+    ds_xy: xr.Dataset = ds_xy.chunk(chunks={"ref_pt": ref_pt_chunksize})
+    ds_xy.to_zarr(
+        store=xy_store,
+        mode="w",
+        encoding={"x": {"dtype": "float32"}, "y": {"dtype": "float32"}},
+        consolidated=True,
+    )
+# Always read x/y back from the Zarr store, so that later computations don't
+# redo the projection, and x/y are float32 on both first and later runs
+ds_xy: xr.Dataset = xr.open_dataset(
+    filename_or_obj=xy_store,
+    chunks={"ref_pt": ref_pt_chunksize},
+    engine="zarr",
+    backend_kwargs={"consolidated": True},
 )
+# Assign the variables positionally along ref_pt (no index alignment needed)
+ds["x"], ds["y"] = ds_xy.x.variable, ds_xy.y.variable
 # Set x, y, x_atc and y_atc as coords of the xarray.Dataset instead of lon/lat
 ds: xr.Dataset = ds.set_coords(names=["x", "y", "x_atc", "y_atc"])
 ds: xr.Dataset = ds.reset_coords(names=["longitude", "latitude"])
 
 
 # %%
-# Mask out low quality height data
+# Mask out low quality height data, keeping heights as float32 so that the
+# reductions over h_corr later on only need to move half the bytes of float64
+ds["h_corr"]: xr.DataArray = ds.h_corr.astype(dtype=np.float32, copy=False)
 ds["h_corr"]: xr.DataArray = ds.h_corr.where(cond=ds.fit_quality == 0)
+assert ds.h_corr.dtype == np.float32
 
 # %% [markdown]
 # ## Trim out unnecessary values (optional)
@@ -111,6 +165,7 @@ ds["h_corr"]: xr.DataArray = ds.h_corr.where(cond=ds.fit_quality == 0)
 #
 # - Subset to geographic region of interest
 # - Ensure there are at least 2 height values to calculate trend over time
+#   (this is done together with the height range calculation further below)
 
 # %%
 # Antarctic bounding box locations with EPSG:3031 coordinates
@@ -123,28 +178,21 @@ placename: str = "antarctica"
 region: deepicedrain.Region = deepicedrain.Region.from_gdf(gdf=regions.loc[placename])
 # ds = region.subset(data=ds)
 
-# %%
-# We need at least 2 points to draw a trend line or compute differences
-# So let's drop points with less than 2 valid values across all cycles
-# Will take maybe 10-15 min to trim down ~220 million points to ~190 million
-print(f"Originally {len(ds.ref_pt)} points")
-# ds: xr.Dataset = ds.dropna(dim="ref_pt", thresh=2, subset=["h_corr"])
-print(f"Trimmed to {len(ds.ref_pt)} points")
-
 # %% [markdown]
 # ### Optimize dataset for big calculations later
 #
 # We'll rechunk the dataset to a reasonable chunk size,
-# and persist key dataset variables in memory so that the parallel
-# computations will be more efficient in later sections.
-
-# %%
-# ds["h_corr"] = ds.h_corr.unify_chunks()
+# so that the parallel computations will be more efficient in later sections.
+# Note that nothing is persisted in distributed memory yet, the height range
+# calculation below only needs one pass over the data.
 
 # %%
-# Persist the height and time data in distributed memory
-ds["h_corr"] = ds.h_corr.persist()
-ds["delta_time"] = ds.delta_time.persist()
+# Each ATL11 Zarr store (one per reference ground track) is opened as its own
+# chunk(s), so merge the smaller chunks across stores into the tall and skinny
+# ref_pt chunk size used when opening the dataset. Note that these merged chunks
+# are at offsets along the concatenated ref_pt dimension, and so will generally
+# not line up with the Zarr chunk edges of each individual store anymore
+ds: xr.Dataset = ds.chunk(chunks={"cycle_number": -1, "ref_pt": ref_pt_chunksize})
 
 # %% [markdown]
 # ### Retrieve some basic information for plots later
@@ -180,22 +228,38 @@ print(f"Handling {num_cycles} ICESat-2 cycles from {min_date} to {max_date}")
 # a short period of time such as 2-5 metres a year (or ~4x91-day ICESat-2 cycles).
 # 'Range of height' is quick way to do this,
 # basically just doing maximum height minus minimum height.
+#
+# We'll also count the number of valid heights at the same time,
+# so that the heights only need to be read once for both calculations.
+
 
 # %%
-# Calculate height range across cycles, parallelized using dask
-ds["h_range"]: xr.DataArray = xr.apply_ufunc(
-    deepicedrain.nanptp,  # min point to max point (range) that handles NaN values
+def count_and_range(h_corr: np.ndarray) -> (np.ndarray, np.ndarray):
+    """
+    Number of valid (non-NaN) heights, and the height range of each point.
+    Only a few cycles are available, so a uint8 is enough for the count.
+    """
+    valid_count: np.ndarray = (~np.isnan(h_corr)).sum(axis=-1, dtype=np.uint8)
+    h_range: np.ndarray = deepicedrain.nanptp(a=h_corr, axis=-1)
+    return valid_count, h_range
+
+
+# %%
+# Calculate valid count and height range across cycles, parallelized using dask
+# and a Numba compiled kernel that finds the min/max in one pass
+ds["valid_count"], ds["h_range"] = xr.apply_ufunc(
+    count_and_range,
     ds.h_corr,
     input_core_dims=[["cycle_number"]],
-    dask="allowed",
-    output_dtypes=[ds.h_corr.dtype],
-    kwargs={"axis": 1},
+    output_core_dims=[[], []],
+    dask="parallelized",
+    output_dtypes=[np.uint8, ds.h_corr.dtype],
 )
 
 # %%
 # %%time
-# Compute height range. Also include all height and time info
-ds_ht: xr.Dataset = ds[["h_range", "h_corr", "delta_time"]].compute()
+# Compute valid count and height range. Also include x/y coordinate info
+ds_ht: xr.Dataset = ds[["valid_count", "h_range"]].compute()
 
 # %%
 # Non-parallelized
@@ -203,26 +267,40 @@ ds_ht: xr.Dataset = ds[["h_range", "h_corr", "delta_time"]].compute()
 # Ensure no height range values which are zero (usually due to only 1 data point)
 # assert len(dask.array.argwhere(dsh.h_range <= 0.0).compute()) == 0
 
+# %%
+# Store height range as int16 with 0.01 m precision (up to 327.67 m, larger
+# values are clipped) and Zstd compression, ~4x smaller than float32 on disk
+zstd: numcodecs.Blosc = numcodecs.Blosc(
+    cname="zstd", clevel=3, shuffle=numcodecs.Blosc.BITSHUFFLE
+)
+hrange_encoding: dict = {
+    "h_range": {
+        "dtype": "int16",
+        "scale_factor": 0.01,
+        "_FillValue": -32768,
+        "compressor": zstd,
+    },
+    "valid_count": {"compressor": zstd},
+}
+ds_ht["h_range"] = ds_ht.h_range.clip(max=327.67)
+
 # %%
 # Save or Load height range data
-# ds_ht.to_zarr(store=f"ATLXI/ds_hrange_time_{placename}.zarr", mode="w", consolidated=True)
+# ds_ht.to_zarr(store=f"ATLXI/ds_hrange_{placename}.zarr", mode="w", encoding=hrange_encoding, consolidated=True)
 ds_ht: xr.Dataset = xr.open_dataset(
-    filename_or_obj=f"ATLXI/ds_hrange_time_{placename}.zarr",
-    chunks={"cycle_number": 9},
+    filename_or_obj=f"ATLXI/ds_hrange_{placename}.zarr",
+    chunks={"ref_pt": ref_pt_chunksize},
     engine="zarr",
     backend_kwargs={"consolidated": True},
 )
-# ds: xr.Dataset = ds_ht  # shortcut for dhdt calculation later
-
-# %%
-df_hr: pd.DataFrame = ds_ht.h_range.to_dataframe()
 
 # %%
-print(df_hr.describe())
+print(ds_ht.h_range.to_pandas().describe())
 
 # %%
 # Datashade our height values (vector points) onto a grid (raster image)
-agg_grid: xr.DataArray = region.datashade(df=df_hr, z_dim="h_range")
+# Passing in the xarray.Dataset directly, to skip a slow to_dataframe step
+agg_grid: xr.DataArray = region.datashade(df=ds_ht, z_dim="h_range")
 print(agg_grid)
 
 # %%
@@ -260,44 +338,95 @@ fig.show(width=600)
 # # Calculate rate of height change over time (dhdt)
 #
 # Performing linear regression in parallel.
-# Uses the [`scipy.stats.linregress`](https://docs.scipy.org/doc/scipy/reference/generated/scipy.stats.linregress.html) function,
+# Uses the `deepicedrain.nan_linregress_block` function, a vectorized version of
+# [`scipy.stats.linregress`](https://docs.scipy.org/doc/scipy/reference/generated/scipy.stats.linregress.html),
 # parallelized with xarray's [`apply_ufunc`](http://xarray.pydata.org/en/v0.15.1/examples/apply_ufunc_vectorize_1d.html) method
 # on a Dask cluster.
 
 # %%
-# Take only the points where there is more than 0.25 metres of elevation change
+# We need at least 2 points to draw a trend line, and let's take only the
+# points where there is more than 0.25 metres of elevation change.
+# Apply both conditions at once using the valid count and height range
+# computed earlier, so that the heights don't have to be read again.
 # Trim down ~220 million points to ~36 million
-# ds = ds.where(cond=ds.h_range > 0.25, drop=True)
+print(f"Originally {len(ds.ref_pt)} points")
+# Index with the integer positions of the points to keep, and restore the
+# tall and skinny chunks since the filtered chunks will be uneven in size
+mask: xr.DataArray = (ds_ht.valid_count >= 2) & (ds_ht.h_range > 0.25)
+ds: xr.Dataset = ds.isel(ref_pt=np.flatnonzero(mask.compute()))
+ds: xr.Dataset = ds.chunk(chunks={"cycle_number": -1, "ref_pt": ref_pt_chunksize})
 print(f"Trimmed to {len(ds.ref_pt)} points")
 
+# %%
+# Store the filtered height and time data as float32 with Zstd compression,
+# so that the linear regression (and any reruns) only reads the reduced subset
+# instead of reading and filtering all the ATL11 points again
+dhdt_input_encoding: dict = {
+    "h_corr": {"dtype": "float32", "compressor": zstd},
+    "delta_time": {"compressor": zstd},
+}
+
+# %%
+# Save or Load filtered height and time data
+# ds[["delta_time", "h_corr"]].to_zarr(store=f"ATLXI/ds_dhdt_input_{placename}.zarr", mode="w", encoding=dhdt_input_encoding, consolidated=True)
+ds: xr.Dataset = xr.open_dataset(
+    filename_or_obj=f"ATLXI/ds_dhdt_input_{placename}.zarr",
+    chunks={"cycle_number": -1, "ref_pt": ref_pt_chunksize},
+    engine="zarr",
+    backend_kwargs={"consolidated": True},
+)
+assert ds.h_corr.dtype == np.float32
+
+# %%
+# Persist the height and time data in distributed memory, just once, and
+# wait for it to be fully loaded before running the linear regression.
+# Uses the same tall and skinny chunks as before, so that each dask task
+# does the linear regression on a big block of points with all cycles
+ds: xr.Dataset = ds[["delta_time", "h_corr"]].persist()
+dask.distributed.wait(fs=ds)
+
+# %%
+# Convert time from nanoseconds (timedelta64) to years (float32) since the
+# 2018-01-01 ATLAS SDP epoch that delta_time is relative to, so that the
+# linear regression works on small and well conditioned numbers, the slope
+# comes out in metres per year, and the intercept is the height at the epoch.
+# 1 year = 365.25 days x 24 hours x 60 min x 60 seconds x 1_000_000_000 nanoseconds
+t_year: xr.DataArray = (
+    ds.delta_time / np.timedelta64(1, "ns") / (365.25 * 24 * 60 * 60 * 1e9)
+).astype(np.float32)
+
 # %%
 # Do linear regression on many datapoints, parallelized using dask
+# Each dask chunk is a (ref_pt, cycle_number) block handled in one vectorized
+# call that returns a (ref_pt, dhdt_parameters) block, no Python loop per point
+# Use deepicedrain.nan_linregress_block_gpu instead if running on GPU workers
 dhdt_params: xr.DataArray = xr.apply_ufunc(
-    deepicedrain.nan_linregress,
-    ds.delta_time.astype(np.uint64),  # x is time in nanoseconds
+    deepicedrain.nan_linregress_block,
+    t_year,  # x is time in years since the ATLAS SDP epoch
     ds.h_corr,  # y is height in metres
-    input_core_dims=[["cycle_number"], ["cycle_number"]],
+    input_core_dims=[["cycle_number"]] * 2,
     output_core_dims=[["dhdt_parameters"]],
-    # output_core_dims=[["slope_ns"], ["intercept"], ["r_value"], ["p_value"], ["std_err"]],
     dask="parallelized",
-    vectorize=True,
+    vectorize=False,
     output_dtypes=[np.float32],
-    output_sizes={"dhdt_parameters": 5},
-    # output_sizes={"slope_ns":1, "intercept":1, "r_value":1, "p_value":1, "std_err":1}
+    dask_gufunc_kwargs={"output_sizes": {"dhdt_parameters": 5}},
 )
 
 # %%
 # Construct an xarray.Dataset containing time, height, and dhdt variables
-ds_dhdt: xr.Dataset = ds[["delta_time", "h_corr"]]
-for var_name, dataarray in zip(
-    ["slope", "intercept", "r_value", "p_value", "std_err"], dhdt_params.transpose()
-):
-    ds_dhdt[f"dhdt_{var_name}"]: xr.DataArray = dataarray
-
-# %%
-# Convert dhdt_slope units from metres per nanosecond to metres per year
-# 1 year = 365.25 days x 24 hours x 60 min x 60 seconds x 1_000_000_000 nanoseconds
-ds_dhdt["dhdt_slope"] = ds_dhdt["dhdt_slope"] * (365.25 * 24 * 60 * 60 * 1_000_000_000)
+# Split the dhdt parameters directly along the named dimension into variables
+dhdt_params: xr.DataArray = dhdt_params.assign_coords(
+    dhdt_parameters=[
+        f"dhdt_{var_name}"
+        for var_name in ["slope", "intercept", "r_value", "p_value", "std_err"]
+    ]
+)
+ds_dhdt: xr.Dataset = xr.merge(
+    objects=[
+        ds[["delta_time", "h_corr"]],
+        dhdt_params.to_dataset(dim="dhdt_parameters"),
+    ]
+)
 
 # %%
 # %%time
@@ -306,14 +435,19 @@ ds_dhdt: xr.Dataset = ds_dhdt.compute()
 
 # %%
 # Do linear regression on single datapoint
-# slope_ns, intercept, r_value, p_value, std_err = nan_linregress(
-#     x=ds.delta_time[:1].data.astype(np.uint64), y=ds.h_corr[:1].data
+# slope_yr, intercept, r_value, p_value, std_err = deepicedrain.nan_linregress(
+#     x=t_year[:1].data, y=ds.h_corr[:1].data
 # )
-# print(slope_ns, intercept, r_value, p_value, std_err)
+# print(slope_yr, intercept, r_value, p_value, std_err)
+
+# %%
+# Store dhdt_slope as float32 with Zstd compression. Not scaled to int16 like
+# h_range, because atlxi_lake.py reads this store with plain zarr (no decoding)
+dhdt_encoding: dict = {"dhdt_slope": {"dtype": "float32", "compressor": zstd}}
 
 # %%
 # Load or Save rate of height change over time (dhdt) data
-# ds_dhdt.to_zarr(store=f"ATLXI/ds_dhdt_{placename}.zarr", mode="w", consolidated=True)
+# ds_dhdt.to_zarr(store=f"ATLXI/ds_dhdt_{placename}.zarr", mode="w", encoding=dhdt_encoding, consolidated=True)
 ds_dhdt: xr.Dataset = xr.open_dataset(
     filename_or_obj=f"ATLXI/ds_dhdt_{placename}.zarr",
     chunks="auto",
@@ -321,12 +455,10 @@ ds_dhdt: xr.Dataset = xr.open_dataset(
     backend_kwargs={"consolidated": True},
 )
 
-# %%
-df_slope: pd.DataFrame = ds_dhdt.dhdt_slope.to_dataframe()
-
 # %%
 # Datashade our height values (vector points) onto a grid (raster image)
-agg_grid: xr.DataArray = region.datashade(df=df_slope, z_dim="dhdt_slope")
+# Passing in the xarray.Dataset directly, to skip a slow to_dataframe step
+agg_grid: xr.DataArray = region.datashade(df=ds_dhdt, z_dim="dhdt_slope")
 print(agg_grid)
 
 # %%
@@ -4,7 +4,13 @@ import logging
 import intake
 
 import deepicedrain
-from deepicedrain.deltamath import calculate_delta, nan_linregress, nanptp
+from deepicedrain.deltamath import (
+    calculate_delta,
+    nan_linregress,
+    nan_linregress_block,
+    nan_linregress_block_gpu,
+    nanptp,
+)
 from deepicedrain.extraload import array_to_dataframe, ndarray_to_parquet, wide_to_long
 from deepicedrain.lake_algorithms import find_clusters
 from deepicedrain.spatiotemporal import (
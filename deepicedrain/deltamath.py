@@ -2,8 +2,12 @@
 DeepIceDrain functions for calculating delta changes, such as for ice elevation
 differencing (dh), measuring lengths of time (dt), and related measures.
 """
+import math
+
+import dask.array
+import numba
 import numpy as np
-import scipy.stats
+import scipy.special
 import xarray as xr
 
 
@@ -31,15 +35,128 @@ def calculate_delta(
     return delta_quantity
 
 
+@numba.guvectorize(
+    ["void(float32[:], float32[:])", "void(float64[:], float64[:])"],
+    "(n)->()",
+    nopython=True,
+    target="parallel",
+    cache=True,
+)
+def _nanptp(a, res):
+    """
+    Numba kernel to get the range of values in a 1D array in one pass,
+    keeping track of the running minimum and maximum while skipping NaNs.
+    """
+    amin, amax = np.inf, -np.inf
+    for value in a:
+        if not math.isnan(value):
+            if value < amin:
+                amin = value
+            if value > amax:
+                amax = value
+    res[0] = amax - amin if amin <= amax else np.NaN
+
+
 def nanptp(a, axis=None) -> np.ndarray:
     """
     Range of values (maximum - minimum) along an axis, ignoring any NaNs.
-    When slices with less than two non-NaN values are encountered,
-    a ``RuntimeWarning`` is raised and Nan is returned for that slice.
+    When slices with no non-NaN values are encountered, NaN is returned for
+    that slice. Integer inputs are cast to float64, so a float64 array is
+    returned for them instead of an integer array.
+
+    Uses a Numba compiled generalized ufunc, so it is fast on large numpy
+    arrays. Dask arrays are handled lazily, one chunk at a time.
 
     Adapted from https://github.com/numpy/numpy/pull/13220
     """
-    return np.nanmax(a=a, axis=axis) - np.nanmin(a=a, axis=axis)
+    if axis is None:
+        a = np.ravel(a)
+        axis = -1
+
+    if isinstance(a, dask.array.Array):
+        return dask.array.apply_gufunc(
+            _nanptp, "(n)->()", a, axis=axis, allow_rechunk=True
+        )
+    return _nanptp(np.asarray(a), axis=axis)
+
+
+@numba.njit(cache=True)
+def _student_t_pvalue(tstat: float, df: int) -> float:
+    """
+    Two-sided p-value of a Student's t-statistic with an integer number of
+    degrees of freedom, using the exact finite series from Abramowitz and
+    Stegun (1964) equations 26.7.3 and 26.7.4.
+    """
+    theta = math.atan(abs(tstat) / math.sqrt(df))
+    sin_theta, cos2_theta = math.sin(theta), math.cos(theta) ** 2
+    if df % 2 == 1:
+        term, series = 1.0, 0.0
+        for k in range(1, (df - 1) // 2 + 1):
+            series += term
+            term *= (2 * k) / (2 * k + 1) * cos2_theta
+        prob = 2 / math.pi * (theta + sin_theta * math.cos(theta) * series)
+    else:
+        term, series = 1.0, 0.0
+        for k in range(1, df // 2 + 1):
+            series += term
+            term *= (2 * k - 1) / (2 * k) * cos2_theta
+        prob = sin_theta * series
+    return max(0.0, 1.0 - prob)
+
+
+@numba.njit(parallel=True, cache=True)
+def _nan_linregress(x, y) -> np.ndarray:
+    """
+    Numba kernel doing linear regression on each row of 2D x and y arrays.
+    Least squares sums are accumulated in one pass over the valid (non-NaN)
+    values, shifted by the first valid value to avoid loss of precision.
+    """
+    linregress_result = np.full(shape=(x.shape[0], 5), fill_value=np.NaN)
+    tiny = 1.0e-20  # to avoid division by zero when rvalue is +/- 1
+
+    for i in numba.prange(x.shape[0]):
+        n, kx, ky = 0, 0.0, 0.0
+        sx, sy, sxx, syy, sxy = 0.0, 0.0, 0.0, 0.0, 0.0
+        for j in range(x.shape[1]):
+            if np.isnan(x[i, j]) or np.isnan(y[i, j]):
+                continue
+            if n == 0:
+                kx, ky = x[i, j], y[i, j]
+            dx, dy = x[i, j] - kx, y[i, j] - ky
+            n += 1
+            sx += dx
+            sy += dy
+            sxx += dx * dx
+            syy += dy * dy
+            sxy += dx * dy
+        if n < 2:
+            continue
+
+        ssxm = sxx - sx * sx / n
+        ssym = syy - sy * sy / n
+        ssxym = sxy - sx * sy / n
+        slope = ssxym / ssxm
+        intercept = (ky + sy / n) - slope * (kx + sx / n)
+
+        r_den = math.sqrt(ssxm * ssym)
+        rvalue = 0.0 if r_den == 0.0 else min(max(ssxym / r_den, -1.0), 1.0)
+
+        df = n - 2
+        if df == 0:  # handle case when only two points are used
+            pvalue = 1.0 if ssym == 0.0 else 0.0
+            stderr = 0.0
+        else:
+            tstat = rvalue * math.sqrt(df / ((1.0 - rvalue) * (1.0 + rvalue) + tiny))
+            pvalue = _student_t_pvalue(tstat, df)
+            stderr = math.sqrt((1 - rvalue ** 2) * ssym / ssxm / df)
+
+        linregress_result[i, 0] = slope
+        linregress_result[i, 1] = intercept
+        linregress_result[i, 2] = rvalue
+        linregress_result[i, 3] = pvalue
+        linregress_result[i, 4] = stderr
+
+    return linregress_result
 
 
 def nan_linregress(x, y) -> np.ndarray:
@@ -50,18 +167,126 @@ def nan_linregress(x, y) -> np.ndarray:
     Stacking the outputs (slope, intercept, rvalue, pvalue, stderr)
     into one numpy.ndarray to keep xarray.apply_ufuncs happy.
     Kudos to https://stackoverflow.com/a/60524715/6611055
+
+    Uses a Numba compiled kernel that gives the same results as
+    `scipy.stats.linregress`. Inputs of shape (..., N) are regressed along
+    the last axis in parallel, returning an output of shape (..., 5).
     """
-    x = np.atleast_2d(x)  # shape of at least (1, 6) instead of (6,)
-    y = np.atleast_2d(y)  # shape of at least (1, 6) instead of (6,)
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    x, y = np.broadcast_arrays(x, y)
 
-    mask = ~np.isnan(y)
-    x = x[mask]  # .where(cond=mask, drop=True)
-    y = y[mask]  # .where(cond=mask, drop=True)
+    linregress_result = _nan_linregress(
+        x.reshape(-1, x.shape[-1]), y.reshape(-1, y.shape[-1])
+    )
 
-    try:
-        linregress_result = np.array(scipy.stats.linregress(x=x, y=y))
-    except ValueError:
-        # if x.size == 0 or y.size == 0:
-        linregress_result = np.full(shape=(5,), fill_value=np.NaN)
+    return linregress_result.reshape(*x.shape[:-1], 5)
 
-    return linregress_result
+
+def _nan_linregress_block(x, y, xp=np) -> np.ndarray:
+    """
+    Closed-form least squares linear regression along the last axis, used by
+    nan_linregress_block_gpu. The sums are computed with the `xp` array module
+    (numpy or cupy), while the p-values are calculated on the host using
+    scipy's vectorized Student's t distribution.
+    """
+    x, y = xp.asarray(x), xp.asarray(y)
+    dtype = np.result_type(x.dtype, y.dtype, np.float32)
+    x = x.astype(xp.float64)
+    y = y.astype(xp.float64)
+    x, y = xp.broadcast_arrays(x, y)
+
+    mask = ~xp.logical_or(xp.isnan(x), xp.isnan(y))
+    x = xp.where(mask, x, np.NaN)
+    y = xp.where(mask, y, np.NaN)
+    n = mask.sum(axis=-1)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        xmean = xp.nansum(x, axis=-1) / n
+        ymean = xp.nansum(y, axis=-1) / n
+        xdev = x - xmean[..., np.newaxis]
+        ydev = y - ymean[..., np.newaxis]
+        ssxm = xp.nansum(xdev ** 2, axis=-1)
+        ssym = xp.nansum(ydev ** 2, axis=-1)
+        ssxym = xp.nansum(xdev * ydev, axis=-1)
+
+        slope = ssxym / ssxm
+        intercept = ymean - slope * xmean
+
+        # Correlation coefficient, set to zero if x or y has no variance
+        r_den = xp.sqrt(ssxm * ssym)
+        rvalue = xp.where(r_den == 0.0, 0.0, ssxym / r_den)
+        rvalue = xp.clip(rvalue, a_min=-1.0, a_max=1.0)
+
+        # t-statistic and standard error with n - 2 degrees of freedom
+        df = n - 2
+        tiny = 1.0e-20  # to avoid division by zero when rvalue is +/- 1
+        tstat = rvalue * xp.sqrt(df / ((1.0 - rvalue) * (1.0 + rvalue) + tiny))
+        stderr = xp.sqrt((1 - rvalue ** 2) * ssym / ssxm / df)
+
+    # Copy results back to the host (only needed if running on the GPU)
+    asnumpy = getattr(xp, "asnumpy", np.asarray)
+    slope, intercept, rvalue, tstat, stderr, ssym, df = (
+        asnumpy(a) for a in (slope, intercept, rvalue, tstat, stderr, ssym, df)
+    )
+
+    # Two-sided p-value from the t-statistic, computed on the whole array at once
+    pvalue = 2 * scipy.special.stdtr(df, -np.abs(tstat))
+
+    # Handle case when only two points are used, like scipy.stats.linregress
+    pvalue = np.where(df == 0, np.where(ssym == 0, 1.0, 0.0), pvalue)
+    stderr = np.where(df == 0, 0.0, stderr)
+
+    linregress_result = np.stack(
+        arrays=[slope, intercept, rvalue, pvalue, stderr], axis=-1
+    )
+    # Return NaN for rows with less than 2 valid points
+    linregress_result[df < 0] = np.NaN
+
+    return linregress_result.astype(dtype, copy=False)
+
+
+def nan_linregress_block(x, y) -> np.ndarray:
+    """
+    Vectorized Linear Regression function that handles NaN values.
+    Works on whole blocks of data at once instead of one point at a time.
+
+    Inputs x and y are arrays of shape (..., N), with the N observations
+    (e.g. one per cycle) along the last axis. Least squares sums are
+    accumulated along that axis in one pass by the Numba compiled kernel
+    used in `nan_linregress`, skipping pairs where x or y is NaN, so that
+    each row gives the same result as `scipy.stats.linregress`.
+
+    Stacking the outputs (slope, intercept, rvalue, pvalue, stderr) along a
+    new last axis, i.e. an output numpy.ndarray of shape (..., 5), to keep
+    xarray.apply_ufuncs happy without needing `vectorize=True`. Sums are
+    calculated in float64, but the output keeps the float dtype of the inputs
+    (e.g. float32 inputs give a float32 output).
+    """
+    x, y = np.asarray(x), np.asarray(y)
+    dtype = np.result_type(x.dtype, y.dtype, np.float32)
+    # Pass float inputs to the kernel as is (it accumulates in float64 anyway)
+    # to avoid making float64 copies of whole blocks
+    x, y = np.broadcast_arrays(x.astype(dtype, copy=False), y.astype(dtype, copy=False))
+
+    linregress_result = _nan_linregress(
+        x.reshape(-1, x.shape[-1]), y.reshape(-1, y.shape[-1])
+    )
+
+    return linregress_result.reshape(*x.shape[:-1], 5).astype(dtype, copy=False)
+
+
+def nan_linregress_block_gpu(x, y) -> np.ndarray:
+    """
+    Vectorized Linear Regression function that handles NaN values.
+    This is a GPU accelerated version that requires cupy!
+
+    Same as `nan_linregress_block`, except that the inputs are copied to the
+    GPU, and the least squares sums along the last axis are computed there
+    using cupy. The output is returned as a numpy.ndarray of shape (..., 5)
+    in CPU memory, so it can be used with xarray.apply_ufunc on a dask-cuda
+    cluster, or called directly on a block of points that fits on the GPU.
+    """
+    import cupy
+
+    return _nan_linregress_block(x=x, y=y, xp=cupy)
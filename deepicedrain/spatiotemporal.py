@@ -4,12 +4,17 @@ Does bounding box region subsets, coordinate/time conversions, and more!
 """
 import dataclasses
 import datetime
+import math
 import os
 import shutil
 import tempfile
+import typing
 
+import dask.array
+import dask.dataframe
 import datashader
 import geopandas as gpd
+import numba
 import numpy as np
 import pandas as pd
 import pyproj
@@ -108,7 +113,7 @@ class Region:
 
     def datashade(
         self,
-        df: pd.DataFrame,
+        df: typing.Union[pd.DataFrame, xr.Dataset],
         x_dim: str = "x",
         y_dim: str = "y",
         z_dim: str = "h_range",
@@ -117,7 +122,20 @@ class Region:
         """
         Convenience function to quickly datashade a table of x, y, z points
         into a grid for visualization purposes, using a mean aggregate function
+
+        The points can also be passed in directly as an xarray.Dataset with
+        1D x, y, z variables, which are stacked into a dask.dataframe instead
+        of going through the much slower xarray.Dataset.to_dataframe method.
         """
+        if isinstance(df, xr.Dataset):
+            columns: list = [x_dim, y_dim, z_dim]
+            df = dask.dataframe.from_dask_array(
+                x=dask.array.stack(
+                    seq=[dask.array.asarray(df[col].data) for col in columns], axis=1
+                ),
+                columns=columns,
+            )
+
         # Datashade our height values (vector points) onto a grid (raster image)
         # Will maintain the correct aspect ratio according to the region bounds
         canvas: datashader.core.Canvas = datashader.Canvas(
@@ -176,6 +194,57 @@ def deltatime_to_utctime(
     return utc_time
 
 
+@numba.njit(parallel=True, cache=True)
+def _lonlat_to_xy_epsg3031(longitude: np.ndarray, latitude: np.ndarray) -> tuple:
+    """
+    Numba kernel for the forward Polar Stereographic (variant B) projection
+    of 1D longitude/latitude arrays to Antarctic EPSG:3031 x/y coordinates,
+    i.e. WGS84 ellipsoid, latitude of true scale at 71°S and longitude of
+    origin at 0°. Formulas are from IOGP Guidance Note 7-2, section 1.3.7.2.
+    """
+    a: float = 6378137.0  # WGS84 semi-major axis
+    e: float = 0.08181919084262149  # WGS84 eccentricity
+    lat_c: float = math.radians(-71.0)  # latitude of standard parallel
+
+    sin_c: float = math.sin(lat_c)
+    t_c: float = math.tan(math.pi / 4 + lat_c / 2) / (
+        ((1 + e * sin_c) / (1 - e * sin_c)) ** (e / 2)
+    )
+    m_c: float = math.cos(lat_c) / math.sqrt(1 - e ** 2 * sin_c ** 2)
+
+    x = np.empty_like(longitude)
+    y = np.empty_like(latitude)
+    for i in numba.prange(longitude.size):
+        lon: float = math.radians(np.float64(longitude[i]))
+        lat: float = math.radians(np.float64(latitude[i]))
+        sin_lat: float = math.sin(lat)
+        t: float = math.tan(math.pi / 4 + lat / 2) / (
+            ((1 + e * sin_lat) / (1 - e * sin_lat)) ** (e / 2)
+        )
+        rho: float = a * m_c * t / t_c
+        x[i] = rho * math.sin(lon)
+        y[i] = rho * math.cos(lon)
+
+    return x, y
+
+
+def _polar_stereographic_south(longitude, latitude) -> (np.ndarray, np.ndarray):
+    """
+    Reprojects longitude/latitude arrays of any shape to EPSG:3031 x/y using
+    the Numba kernel above. Output dtype follows the input float dtype.
+    """
+    longitude, latitude = np.broadcast_arrays(
+        np.asarray(longitude), np.asarray(latitude)
+    )
+    dtype = np.result_type(longitude.dtype, latitude.dtype, np.float32)
+
+    x, y = _lonlat_to_xy_epsg3031(
+        np.ravel(longitude).astype(dtype), np.ravel(latitude).astype(dtype)
+    )
+
+    return x.reshape(longitude.shape), y.reshape(latitude.shape)
+
+
 def lonlat_to_xy(
     longitude: xr.DataArray, latitude: xr.DataArray, epsg: int = 3031
 ) -> (xr.DataArray, xr.DataArray):
@@ -183,7 +252,10 @@ def lonlat_to_xy(
     Reprojects longitude/latitude EPSG:4326 coordinates to x/y coordinates.
     Default conversion is to Antarctic Stereographic Projection EPSG:3031.
 
-    See also https://pyproj4.github.io/pyproj/latest/api/proj.html#pyproj-proj
+    The default EPSG:3031 conversion uses a Numba compiled implementation of
+    the Polar Stereographic formulas, applied lazily to each chunk of a dask
+    backed xarray.DataArray. Other EPSG codes are handled by pyproj, see also
+    https://pyproj4.github.io/pyproj/latest/api/proj.html#pyproj-proj
 
     Parameters
     ----------
@@ -205,6 +277,20 @@ def lonlat_to_xy(
     y : xr.DataArray or dask.dataframe.core.Series
         The transformed y coordinate(s).
     """
+    if epsg == 3031:
+        if hasattr(longitude, "coords"):
+            dtype = np.result_type(longitude.dtype, latitude.dtype, np.float32)
+            return xr.apply_ufunc(
+                _polar_stereographic_south,
+                longitude,
+                latitude,
+                output_core_dims=[[], []],
+                dask="parallelized",
+                output_dtypes=[dtype, dtype],
+            )
+        else:
+            return _polar_stereographic_south(longitude, latitude)
+
     x, y = pyproj.Proj(projparams=epsg)(longitude, latitude)
 
     if hasattr(longitude, "coords"):
@@ -1,11 +1,19 @@
 """
-Tests the nan_linregress function
+Tests the nan_linregress, nan_linregress_block and nan_linregress_block_gpu
+functions
 """
 import numpy as np
 import numpy.testing as npt
+import pytest
+import scipy.stats
 import xarray as xr
 
-from deepicedrain import nan_linregress, catalog
+from deepicedrain import (
+    catalog,
+    nan_linregress,
+    nan_linregress_block,
+    nan_linregress_block_gpu,
+)
 
 
 def test_nan_linregress():
@@ -40,3 +48,99 @@ def test_nan_linregress_with_nan():
         actual=linregress_result,
         desired=[0.01, 24.5, 0.282842712, 0.717157288, 0.0239791576],
     )
+
+
+def test_nan_linregress_block():
+    """
+    Check that performing vectorized linear regression on many data points
+    at once gives the same results as running nan_linregress on each point.
+    """
+    atl11_dataset: xr.Dataset = catalog.test_data.atl11_test_case.to_dask()
+    x = atl11_dataset.delta_time.astype(np.uint64).data.compute()
+    y = atl11_dataset.h_corr.data.compute()
+
+    linregress_result: np.ndarray = nan_linregress_block(x=x, y=y)
+
+    assert linregress_result.shape == (1404, 5)
+    for i in range(0, 1404, 100):
+        npt.assert_allclose(
+            actual=linregress_result[i],
+            desired=nan_linregress(x=x[i], y=y[i]),
+            rtol=1e-6,
+        )
+
+
+def test_nan_linregress_block_with_nan():
+    """
+    Check that performing vectorized linear regression works even with NaN
+    values, and that rows with less than 2 valid values return NaN.
+    """
+    x = np.array([[100, 200, np.NaN, 400, 500], [100, 200, 300, 400, 500]])
+    y = np.array([[20, 35, np.NaN, 25, 30], [np.NaN, np.NaN, 15, np.NaN, np.NaN]])
+
+    linregress_result: np.ndarray = nan_linregress_block(x=x, y=y)
+
+    npt.assert_allclose(
+        actual=linregress_result,
+        desired=[
+            [0.01, 24.5, 0.282842712, 0.717157288, 0.0239791576],
+            [np.NaN, np.NaN, np.NaN, np.NaN, np.NaN],
+        ],
+    )
+
+
+def test_nan_linregress_block_float32():
+    """
+    Check that performing vectorized linear regression on float32 inputs
+    returns a float32 output with shape (..., 5).
+    """
+    x = np.linspace(start=0, stop=2, num=24, dtype=np.float32).reshape(2, 2, 6)
+    y = 1.5 * x + 10
+
+    linregress_result: np.ndarray = nan_linregress_block(x=x, y=y)
+
+    assert linregress_result.dtype == np.float32
+    assert linregress_result.shape == (2, 2, 5)
+    npt.assert_allclose(actual=linregress_result[..., 0], desired=1.5, rtol=1e-5)
+    npt.assert_allclose(actual=linregress_result[..., 1], desired=10, rtol=1e-5)
+
+
+def test_nan_linregress_pvalue():
+    """
+    Check that the p-values from the vectorized functions match those from
+    scipy.stats.linregress, for rows with different numbers of valid values
+    (i.e. different degrees of freedom).
+    """
+    x = np.tile(A=np.arange(10, dtype=np.float64), reps=(8, 1))
+    y = np.sin(np.arange(80)).reshape(8, 10) + 0.1 * x
+    for i in range(8):
+        y[i, i + 2 :] = np.NaN  # 2 to 9 valid values
+
+    desired = [
+        scipy.stats.linregress(x=x[i, : i + 2], y=y[i, : i + 2]).pvalue
+        for i in range(8)
+    ]
+    npt.assert_allclose(
+        actual=nan_linregress_block(x=x, y=y)[:, 3], desired=desired, atol=1e-12
+    )
+    npt.assert_allclose(
+        actual=nan_linregress(x=x, y=y)[:, 3], desired=desired, atol=1e-12
+    )
+
+
+def test_nan_linregress_block_gpu():
+    """
+    Check that performing vectorized linear regression on the GPU gives the
+    same results as on the CPU, returned as a numpy.ndarray.
+    """
+    pytest.importorskip(modname="cupy")
+
+    x = np.array([[100, 200, np.NaN, 400, 500], [100, 200, 300, 400, 500]])
+    y = np.array([[20, 35, np.NaN, 25, 30], [np.NaN, np.NaN, 15, np.NaN, np.NaN]])
+
+    linregress_result: np.ndarray = nan_linregress_block_gpu(x=x, y=y)
+
+    assert isinstance(linregress_result, np.ndarray)
+    npt.assert_allclose(
+        actual=linregress_result, desired=nan_linregress_block(x=x, y=y)
+    )
@@ -1,6 +1,7 @@
 """
 Tests the nanptp function
 """
+import dask.array
 import numpy as np
 import numpy.testing as npt
 import xarray as xr
@@ -33,3 +34,19 @@ def test_nanptp_with_nan():
 
     assert isinstance(height_range, np.ndarray)
     npt.assert_equal(actual=height_range, desired=189)
+
+
+def test_nanptp_dask_array():
+    """
+    Check that calculating point to point range works lazily on a chunked
+    dask.array, including on slices that are all NaN.
+    """
+    a = dask.array.from_array(
+        x=[[123, 231, np.NaN, 312, 213], [np.NaN, np.NaN, np.NaN, np.NaN, np.NaN]],
+        chunks=(1, 3),
+    )
+
+    height_range: dask.array.Array = nanptp(a=a, axis=1)
+
+    assert isinstance(height_range, dask.array.Array)
+    npt.assert_equal(actual=height_range.compute(), desired=[189, np.NaN])
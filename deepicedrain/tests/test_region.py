@@ -66,6 +66,29 @@ def test_region_datashade():
     npt.assert_allclose(agg_grid.max(), 1798.066285)
 
 
+def test_region_datashade_xarray_dataset():
+    """
+    Tests that we can datashade an xarray.Dataset directly, and get the same
+    result as datashading its equivalent pandas.DataFrame
+    """
+    region = Region("South Pole", -100, 100, -100, 100)
+    rng = np.random.default_rng(seed=42)
+    dataset = xr.Dataset(
+        data_vars={"h_range": ("ref_pt", rng.random(size=1000))},
+        coords={
+            "x": ("ref_pt", rng.uniform(low=-120, high=120, size=1000)),
+            "y": ("ref_pt", rng.uniform(low=-120, high=120, size=1000)),
+        },
+    ).chunk(chunks={"ref_pt": 300})
+
+    agg_grid: xr.DataArray = region.datashade(df=dataset, plot_width=20)
+
+    assert agg_grid.shape == (20, 20)
+    xr.testing.assert_allclose(
+        agg_grid, region.datashade(df=dataset.to_dataframe(), plot_width=20)
+    )
+
+
 def test_region_from_geodataframe():
     """
     Test that we can create a deepicedrain.Region object from a single
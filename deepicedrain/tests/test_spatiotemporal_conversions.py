@@ -98,15 +98,16 @@ def test_lonlat_to_xy_dask_series():
     x, y = lonlat_to_xy(
         longitude=atl11_dataframe.longitude, latitude=atl11_dataframe.latitude
     )
-    npt.assert_equal(actual=x.mean(), desired=-56900105.00307033)
-    npt.assert_equal(actual=y.mean(), desired=48141607.48486084)
+    npt.assert_allclose(actual=x.mean(), desired=-56900105.00307033, rtol=1e-10)
+    npt.assert_allclose(actual=y.mean(), desired=48141607.48486084, rtol=1e-10)
 
 
 def test_lonlat_to_xy_xarray_dataarray():
     """
     Test that converting from longitude/latitude to x/y in EPSG:3031 works when
     passing them in as xarray.DataArray objects. Ensure that the xarray
-    dimensions are preserved in the process.
+    dimensions are preserved in the process, and that dask backed arrays are
+    reprojected lazily.
     """
     atl11_dataset: xr.Dataset = catalog.test_data.atl11_test_case.to_dask()
 
@@ -116,5 +117,22 @@ def test_lonlat_to_xy_xarray_dataarray():
 
     assert x.dims == y.dims == ("ref_pt",)
     assert x.shape == y.shape == (1404,)
-    npt.assert_equal(actual=x.mean().data, desired=-56900105.00307034)
-    npt.assert_equal(actual=y.mean().data, desired=48141607.48486084)
+    assert dask.is_dask_collection(x) and dask.is_dask_collection(y)
+    npt.assert_allclose(actual=x.mean().data, desired=-56900105.00307034, rtol=1e-10)
+    npt.assert_allclose(actual=y.mean().data, desired=48141607.48486084, rtol=1e-10)
+
+
+def test_lonlat_to_xy_float32():
+    """
+    Test that converting from longitude/latitude to x/y in EPSG:3031 keeps the
+    float32 dtype of the inputs, and matches the expected coordinates at the
+    South Pole and along the 71°S latitude of true scale.
+    """
+    longitude = np.array([0, 0, 90, 180], dtype=np.float32)
+    latitude = np.array([-90, -71, -71, -71], dtype=np.float32)
+
+    x, y = lonlat_to_xy(longitude=longitude, latitude=latitude)
+
+    assert x.dtype == y.dtype == np.float32
+    npt.assert_allclose(actual=x, desired=[0, 0, 2082760.1, 0], atol=0.5)
+    npt.assert_allclose(actual=y, desired=[0, 2082760.1, 0, -2082760.1], atol=0.5)